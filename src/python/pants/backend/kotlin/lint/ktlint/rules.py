@@ -44,6 +44,9 @@ class KtlintRequest(FmtTargetsRequest):
 async def ktlint_fmt(
     request: KtlintRequest.Batch, tool: KtlintSubsystem, jdk: InternalJdk
 ) -> FmtResult:
+    # NB: `materialize_classpath_for_tool` is a rule, so the engine memoizes this lookup on the
+    # (frozen) request for the lifetime of the daemon: only the first batch pays for resolving
+    # and fetching the classpath, and later batches reuse the same content-addressed digest.
     lockfile_request = GenerateJvmLockfileFromTool.create(tool)
     tool_classpath = await materialize_classpath_for_tool(
         ToolClasspathRequest(lockfile=lockfile_request)
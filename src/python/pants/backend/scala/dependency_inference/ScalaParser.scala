@@ -539,6 +539,8 @@ class SourceAnalysisTraverser extends Traverser {
 }
 
 object ScalaParser {
+  private val jsonPrinter = Printer.noSpaces.copy(dropNullValues = true)
+
   def analyze(pathStr: String, scalaVersion: String, source3: Boolean): Analysis = {
     val path = java.nio.file.Paths.get(pathStr)
     val bytes = java.nio.file.Files.readAllBytes(path)
@@ -574,12 +576,20 @@ object ScalaParser {
     val source3 = args(3).toBoolean
     val analysis = analyze(pathStr, scalaVersion, source3)
 
-    val json = analysis.asJson.noSpaces
-    java.nio.file.Files.write(
+    // Print straight into a UTF-8 byte buffer rather than through an intermediate `String`, and
+    // drop `null` values (i.e. unset import aliases), which the Python side treats as absent.
+    val json = jsonPrinter.printToByteBuffer(analysis.asJson)
+    val channel = java.nio.channels.FileChannel.open(
       outputPath,
-      json.getBytes(),
       java.nio.file.StandardOpenOption.CREATE_NEW,
       java.nio.file.StandardOpenOption.WRITE
     )
+    try {
+      while (json.hasRemaining) {
+        channel.write(json)
+      }
+    } finally {
+      channel.close()
+    }
   }
 }
@@ -2,11 +2,15 @@
 # Licensed under the Apache License, Version 2.0 (see LICENSE).
 from __future__ import annotations
 
+import bisect
+import functools
 import json
 import logging
 import os
-from dataclasses import dataclass
-from typing import Any, Iterator, Mapping
+import sys
+import weakref
+from dataclasses import dataclass, fields
+from typing import Any, ClassVar, Iterator, Mapping, Optional, Tuple, TypeVar, overload
 
 from pants.backend.scala.subsystems.scala import ScalaSubsystem
 from pants.backend.scala.subsystems.scalac import Scalac
@@ -25,7 +29,6 @@ from pants.engine.fs import (
     DigestContents,
     Directory,
     FileContent,
-    MergeDigests,
     RemovePrefix,
 )
 from pants.engine.internals.selectors import Get, MultiGet
@@ -49,14 +52,123 @@ from pants.util.resources import read_resource
 logger = logging.getLogger(__name__)
 
 
-_PARSER_SCALA_VERSION = ScalaVersion.parse("2.13.8")
+_PARSER_SCALA_VERSION = ScalaVersion(major=2, minor=13, patch=8)
 _PARSER_SCALA_BINARY_VERSION = _PARSER_SCALA_VERSION.binary
 
+_T = TypeVar("_T")
+_V = TypeVar("_V")
+
+# The analyses of all Scala files are held in memory by the engine, and the same imports and
+# symbols (e.g. `scala.collection.mutable._` or `String`) recur in most of them. Identical
+# instances are shared through this weak-valued table, so that each is only stored once for as long
+# as any analysis refers to it.
+_SHARED_INSTANCES: weakref.WeakValueDictionary[tuple[Any, ...], Any] = weakref.WeakValueDictionary()
+
+
+def _shared(cls: type[_T], *fields: Any) -> _T:
+    key = (cls, *fields)
+    instance = _SHARED_INSTANCES.get(key)
+    if instance is None:
+        instance = cls(*fields)
+        _SHARED_INSTANCES[key] = instance
+    return instance
+
+
+class _FrozenSlots:
+    """Support for copying and pickling a frozen dataclass which declares `__slots__` by hand.
+
+    The default state of a slotted instance is restored with `setattr`, which a frozen dataclass
+    forbids, so (as `@dataclass(slots=True)` would on newer Pythons) this restores each field with
+    `object.__setattr__` instead.
+    """
+
+    __slots__ = ()
+
+    __dataclass_fields__: ClassVar[dict[str, Any]]
+
+    def __getstate__(self) -> list[Any]:
+        return [getattr(self, f.name) for f in fields(self)]
+
+    def __setstate__(self, state: list[Any]) -> None:
+        for f, value in zip(fields(self), state):
+            object.__setattr__(self, f.name, value)
+
+
+class _SortedScopeMap(Mapping[str, _V]):
+    """An immutable mapping from scope names, stored as parallel tuples of keys and values.
+
+    Each analysis only maps a handful of scopes, so for the many analyses which are held in memory
+    at once, this is considerably more compact than a `FrozenDict` (which wraps a `dict`). Keys are
+    sorted, and looked up by bisection, so (unlike a `FrozenDict`) it iterates in order of scope
+    name rather than in the order in which the parser emitted the scopes.
+
+    Like any `Mapping`, it is equal to a `dict` or `FrozenDict` with the same items, and its hash is
+    computed the same way as that of a `FrozenDict`, so that equal instances of either hash equally.
+    """
+
+    __slots__ = ("_keys", "_values", "_hash")
+
+    def __init__(self, items: Mapping[str, _V]) -> None:
+        self._keys = tuple(sorted(items))
+        self._values = tuple(items[key] for key in self._keys)
+        # NB: Matches `FrozenDict._calculate_hash`: the xor of the hash of every item.
+        h = 0
+        for item in zip(self._keys, self._values):
+            h ^= hash(item)
+        self._hash = h
+
+    def _index(self, key: str) -> int | None:
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return None
+
+    def __getitem__(self, key: str) -> _V:
+        index = self._index(key)
+        if index is None:
+            raise KeyError(key)
+        return self._values[index]
+
+    @overload
+    def get(self, key: str) -> _V | None:
+        ...
+
+    @overload
+    def get(self, key: str, default: _V | _T) -> _V | _T:
+        ...
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # NB: Overridden to avoid raising and catching a `KeyError` for every missing scope.
+        index = self._index(key)
+        return default if index is None else self._values[index]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __eq__(self, other: Any) -> Any:
+        if isinstance(other, _SortedScopeMap):
+            # NB: Both sides are sorted by key, so there is no need to build dicts to compare them.
+            return self._keys == other._keys and self._values == other._values
+        return super().__eq__(other)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(zip(self._keys, self._values))!r})"
+
 
 class ScalaParser(JvmToolBase):
     options_scope = "scala-parser"
     help = "Internal tool for parsing Scala sources to identify dependencies"
 
+    # NB: Only `scalameta` itself (for the `scala.meta` package object), its parsers and trees, and
+    # circe are used by the parser. `scalameta` also pulls in `scalap` and through it
+    # `scala-compiler` (along with `jline`, `jna` and `scala-reflect`), which are never loaded at
+    # runtime, but default tool artifacts are plain coordinates that cannot declare exclusions.
     default_artifacts = (
         f"org.scalameta:scalameta_{_PARSER_SCALA_BINARY_VERSION}:4.8.7",
         f"io.circe:circe-generic_{_PARSER_SCALA_BINARY_VERSION}:0.14.1",
@@ -71,14 +183,23 @@ class ScalaParser(JvmToolBase):
 
 
 @dataclass(frozen=True)
-class ScalaImport:
+class ScalaImport(_FrozenSlots):
+    # NB: Instances are shared via `_SHARED_INSTANCES`, which requires them to be weakly referenceable.
+    __slots__ = ("name", "alias", "is_wildcard", "__weakref__")
+
     name: str
     alias: str | None
     is_wildcard: bool
 
     @classmethod
     def from_json_dict(cls, data: Mapping[str, Any]):
-        return cls(name=data["name"], alias=data.get("alias"), is_wildcard=data["isWildcard"])
+        alias = data.get("alias")
+        return _shared(
+            cls,
+            sys.intern(data["name"]),
+            sys.intern(alias) if alias is not None else None,
+            data["isWildcard"],
+        )
 
     def to_debug_json_dict(self) -> dict[str, Any]:
         return {
@@ -89,13 +210,18 @@ class ScalaImport:
 
 
 @dataclass(frozen=True)
-class ScalaProvidedSymbol:
+class ScalaProvidedSymbol(_FrozenSlots):
+    # NB: Unlike imports and consumed symbols, provided symbols are fully qualified definitions,
+    # which are almost always unique to a file, so instances are not shared via `_SHARED_INSTANCES`
+    # (each entry of which would cost more than the instance itself).
+    __slots__ = ("name", "recursive")
+
     name: str
     recursive: bool
 
     @classmethod
     def from_json_dict(cls, data: Mapping[str, Any]):
-        return cls(name=data["name"], recursive=data["recursive"])
+        return cls(name=sys.intern(data["name"]), recursive=data["recursive"])
 
     def to_debug_json_dict(self) -> dict[str, Any]:
         return {
@@ -105,13 +231,15 @@ class ScalaProvidedSymbol:
 
 
 @dataclass(frozen=True)
-class ScalaConsumedSymbol:
+class ScalaConsumedSymbol(_FrozenSlots):
+    __slots__ = ("name", "is_absolute", "__weakref__")
+
     name: str
     is_absolute: bool
 
     @classmethod
     def from_json_dict(cls, data: Mapping[str, Any]):
-        return cls(name=data["name"], is_absolute=data["isAbsolute"])
+        return _shared(cls, sys.intern(data["name"]), data["isAbsolute"])
 
     @property
     def is_qualified(self) -> bool:
@@ -128,12 +256,30 @@ class ScalaConsumedSymbol:
         return {"name": self.name, "isAbsolute": self.is_absolute}
 
 
+# For a scope: its dotted prefix (e.g. `org.example.`) if it is a package declaration, and the
+# imports declared in it, each paired with the dotted prefix of its name.
+_QualifyingScope = Tuple[Optional[str], Tuple[Tuple[ScalaImport, str], ...]]
+
+
 @dataclass(frozen=True)
-class ScalaSourceDependencyAnalysis:
+class ScalaSourceDependencyAnalysis(_FrozenSlots):
+    __slots__ = (
+        "provided_symbols",
+        "provided_symbols_encoded",
+        "imports_by_scope",
+        "_consumed_symbols_by_scope",
+        "scopes",
+    )
+
     provided_symbols: FrozenOrderedSet[ScalaProvidedSymbol]
     provided_symbols_encoded: FrozenOrderedSet[ScalaProvidedSymbol]
-    imports_by_scope: FrozenDict[str, tuple[ScalaImport, ...]]
-    _consumed_symbols_by_scope: FrozenDict[str, FrozenOrderedSet[ScalaConsumedSymbol]]
+    imports_by_scope: Mapping[str, tuple[ScalaImport, ...]]
+    # NB: Within each scope, consumed symbols are kept in the (deterministic) order in which the
+    # parser emits them, so that the symbols inferred from them (and any warnings about them) are
+    # stable across runs. Scopes themselves are iterated in order of scope name, as are imports, so
+    # ambiguity warnings are emitted in order of scope name, and in parser order within a scope.
+    # Symbols are de-duplicated into a tuple, which is smaller than a `FrozenOrderedSet`.
+    _consumed_symbols_by_scope: _SortedScopeMap[tuple[ScalaConsumedSymbol, ...]]
     scopes: FrozenOrderedSet[str]
 
     def all_imports(self) -> Iterator[str]:
@@ -142,7 +288,7 @@ class ScalaSourceDependencyAnalysis:
             for imp in imports:
                 yield imp.name
 
-    def fully_qualified_consumed_symbols(self) -> Iterator[str]:
+    def fully_qualified_consumed_symbols(self) -> tuple[str, ...]:
         """Consumed symbols qualified in various ways.
 
         This method _will_ introduce false-positives, because we will assume that the symbol could
@@ -150,43 +296,73 @@ class ScalaSourceDependencyAnalysis:
         package.
         """
 
-        def scope_and_parents(scope: str) -> Iterator[str]:
-            while True:
-                yield scope
-                if scope == "":
-                    break
-                scope, _, _ = scope.rpartition(".")
+        # For each scope, the scope itself and those of its parents which could qualify a symbol:
+        # i.e. those which are a package declaration or have any imports. Scopes are nested by their
+        # dotted names, so each distinct scope is resolved once, and then shares the entries of its
+        # parent with every other scope under that parent.
+        qualifying_scopes_by_scope: dict[str, tuple[_QualifyingScope, ...]] = {}
+
+        def qualifying_scopes(scope: str) -> tuple[_QualifyingScope, ...]:
+            qualifying = qualifying_scopes_by_scope.get(scope)
+            if qualifying is not None:
+                return qualifying
+
+            package_prefix = f"{scope}." if scope in self.scopes else None
+            imports = tuple((imp, f"{imp.name}.") for imp in self.imports_by_scope.get(scope, ()))
+            qualifying = ((package_prefix, imports),) if package_prefix or imports else ()
+            if scope != "":
+                qualifying += qualifying_scopes(scope.rpartition(".")[0])
+
+            qualifying_scopes_by_scope[scope] = qualifying
+            return qualifying
+
+        # NB: Callers consume every name at once, so they are collected eagerly (with a bound
+        # `append`) rather than paying the generator protocol's overhead for every single name.
+        fully_qualified: list[str] = []
+        append = fully_qualified.append
 
         for consumption_scope, consumed_symbols in self._consumed_symbols_by_scope.items():
-            parent_scopes = tuple(scope_and_parents(consumption_scope))
+            # Everything that only depends on the consumption scope is resolved once here, rather
+            # than once per consumed symbol.
+            parent_scopes = qualifying_scopes(consumption_scope)
+
             for symbol in consumed_symbols:
                 if not self.scopes or symbol.is_qualified or symbol.is_absolute:
-                    yield symbol.name
+                    append(symbol.name)
 
                 if symbol.is_absolute:
                     # We do not need to qualify this symbol any further as we know its
                     # name is the actual fully qualified name
                     continue
 
-                for parent_scope in parent_scopes:
-                    if parent_scope in self.scopes:
+                is_qualified = symbol.is_qualified
+                if is_qualified:
+                    symbol_rel_prefix, symbol_rel_suffix = symbol.split()
+                    dotted_symbol_rel_prefix = f".{symbol_rel_prefix}"
+
+                # NB: The dotted prefixes are computed once per scope and import, so qualifying a
+                # symbol is a single string concatenation rather than formatting a new f-string.
+                symbol_name = symbol.name
+                for package_prefix, imports in parent_scopes:
+                    if package_prefix is not None:
                         # A package declaration is a parent of this scope, and any of its symbols
                         # could be in scope.
-                        yield f"{parent_scope}.{symbol.name}"
+                        append(package_prefix + symbol_name)
 
-                    for imp in self.imports_by_scope.get(parent_scope, ()):
+                    for imp, imp_prefix in imports:
                         if imp.is_wildcard:
                             # There is a wildcard import in a parent scope.
-                            yield f"{imp.name}.{symbol.name}"
-                        if symbol.is_qualified:
+                            append(imp_prefix + symbol_name)
+                        if is_qualified:
                             # If the parent scope has an import which defines the first token of the
                             # symbol, then it might be a relative usage of an import.
-                            symbol_rel_prefix, symbol_rel_suffix = symbol.split()
                             if imp.alias:
                                 if imp.alias == symbol_rel_prefix:
-                                    yield f"{imp.name}.{symbol_rel_suffix}"
-                            elif imp.name.endswith(f".{symbol_rel_prefix}"):
-                                yield f"{imp.name}.{symbol_rel_suffix}"
+                                    append(imp_prefix + symbol_rel_suffix)
+                            elif imp.name.endswith(dotted_symbol_rel_prefix):
+                                append(imp_prefix + symbol_rel_suffix)
+
+        return tuple(fully_qualified)
 
     @property
     def consumed_symbols_by_scope(self) -> FrozenDict[str, FrozenOrderedSet[str]]:
@@ -199,6 +375,9 @@ class ScalaSourceDependencyAnalysis:
 
     @classmethod
     def from_json_dict(cls, d: dict) -> ScalaSourceDependencyAnalysis:
+        # NB: Symbol and scope names repeat heavily both within a single analysis and across the
+        # analyses of all the files in a repo (which are memoized by the engine), so we intern them
+        # to share a single copy of each string.
         return cls(
             provided_symbols=FrozenOrderedSet(
                 ScalaProvidedSymbol.from_json_dict(v) for v in d["providedSymbols"]
@@ -206,19 +385,21 @@ class ScalaSourceDependencyAnalysis:
             provided_symbols_encoded=FrozenOrderedSet(
                 ScalaProvidedSymbol.from_json_dict(v) for v in d["providedSymbolsEncoded"]
             ),
-            imports_by_scope=FrozenDict(
+            imports_by_scope=_SortedScopeMap(
                 {
-                    key: tuple(ScalaImport.from_json_dict(v) for v in values)
+                    sys.intern(key): tuple(ScalaImport.from_json_dict(v) for v in values)
                     for key, values in d["importsByScope"].items()
                 }
             ),
-            _consumed_symbols_by_scope=FrozenDict(
+            _consumed_symbols_by_scope=_SortedScopeMap(
                 {
-                    key: FrozenOrderedSet(ScalaConsumedSymbol.from_json_dict(v) for v in values)
+                    sys.intern(key): tuple(
+                        dict.fromkeys(ScalaConsumedSymbol.from_json_dict(v) for v in values)
+                    )
                     for key, values in d["consumedSymbolsByScope"].items()
                 }
             ),
-            scopes=FrozenOrderedSet(d["scopes"]),
+            scopes=FrozenOrderedSet(sys.intern(scope) for scope in d["scopes"]),
         )
 
     def to_debug_json_dict(self) -> dict[str, Any]:
@@ -240,7 +421,9 @@ class ScalaSourceDependencyAnalysis:
 
 
 @dataclass(frozen=True)
-class FallibleScalaSourceDependencyAnalysisResult:
+class FallibleScalaSourceDependencyAnalysisResult(_FrozenSlots):
+    __slots__ = ("process_result",)
+
     process_result: FallibleProcessResult
 
 
@@ -282,15 +465,17 @@ async def create_analyze_scala_source_request(
 @rule(level=LogLevel.DEBUG)
 async def analyze_scala_source_dependencies(
     jdk: InternalJdk,
-    processor_classfiles: ScalaParserCompiledClassfiles,
     tool: ScalaParser,
     request: AnalyzeScalaSourceRequest,
 ) -> FallibleScalaSourceDependencyAnalysisResult:
     source_files = request.source_files
 
+    # NB: Sources are deliberately analyzed one file per process rather than in batches: the
+    # process cache is then keyed by a single file's content, so editing one file only re-analyzes
+    # that file. JVM startup is amortized across files by nailgun instead.
     if len(source_files.files) > 1:
         raise ValueError(
-            f"analyze_scala_source_dependencies expects sources with exactly 1 source file, but found {len(source_files.snapshot.files)}."
+            f"analyze_scala_source_dependencies expects sources with exactly 1 source file, but found {len(source_files.files)}."
         )
     elif len(source_files.files) == 0:
         raise ValueError(
@@ -301,7 +486,11 @@ async def analyze_scala_source_dependencies(
     processorcp_relpath = "__processorcp"
     toolcp_relpath = "__toolcp"
 
-    tool_classpath, prefixed_source_files_digest = await MultiGet(
+    # NB: The parser classfiles are requested alongside the other inputs (rather than as a rule
+    # parameter, which would be computed before this rule even starts), so that a cold compile of
+    # the parser runs concurrently with preparing the process inputs.
+    processor_classfiles, tool_classpath, prefixed_source_files_digest = await MultiGet(
+        Get(ScalaParserCompiledClassfiles),
         Get(
             ToolClasspath,
             ToolClasspathRequest(lockfile=GenerateJvmLockfileFromTool.create(tool)),
@@ -332,6 +521,7 @@ async def analyze_scala_source_dependencies(
                 str(request.source3),
             ],
             input_digest=prefixed_source_files_digest,
+            extra_jvm_options=tool.jvm_options,
             extra_immutable_input_digests=extra_immutable_input_digests,
             output_files=(analysis_output_path,),
             extra_nailgun_keys=extra_immutable_input_digests,
@@ -360,6 +550,21 @@ async def resolve_fallible_result_to_analysis(
     return ScalaSourceDependencyAnalysis.from_json_dict(analysis)
 
 
+_PARSER_PACKAGE = "pants.backend.scala.dependency_inference"
+_PARSER_SOURCE = "ScalaParser.scala"
+
+
+@functools.cache
+def _read_parser_source() -> bytes:
+    # NB: The bundled source never changes for the life of the process, so it is read (with
+    # blocking IO) at most once rather than every time the compile rule below is re-evaluated. It
+    # is not read at import time, so that loading this module stays cheap for non-Scala users.
+    parser_source_content = read_resource(_PARSER_PACKAGE, _PARSER_SOURCE)
+    if not parser_source_content:
+        raise AssertionError(f"Unable to find {_PARSER_SOURCE} resource.")
+    return parser_source_content
+
+
 # TODO(13879): Consolidate compilation of wrapper binaries to common rules.
 @rule
 async def setup_scala_parser_classfiles(
@@ -367,23 +572,19 @@ async def setup_scala_parser_classfiles(
 ) -> ScalaParserCompiledClassfiles:
     dest_dir = "classfiles"
 
-    parser_source_content = read_resource(
-        "pants.backend.scala.dependency_inference", "ScalaParser.scala"
-    )
-    if not parser_source_content:
-        raise AssertionError("Unable to find ScalaParser.scala resource.")
-
-    parser_source = FileContent("ScalaParser.scala", parser_source_content)
+    parser_source = FileContent(_PARSER_SOURCE, _read_parser_source())
 
     scala_artifacts = await Get(
         ScalaArtifactsForVersionResult, ScalaArtifactsForVersionRequest(_PARSER_SCALA_VERSION)
     )
 
+    toolcp_relpath = "__toolcp"
+    parsercp_relpath = "__parsercp"
+
     tool_classpath, parser_classpath, source_digest = await MultiGet(
         Get(
             ToolClasspath,
             ToolClasspathRequest(
-                prefix="__toolcp",
                 artifact_requirements=ArtifactRequirements.from_coordinates(
                     scala_artifacts.all_coordinates
                 ),
@@ -391,45 +592,54 @@ async def setup_scala_parser_classfiles(
         ),
         Get(
             ToolClasspath,
-            ToolClasspathRequest(
-                prefix="__parsercp", lockfile=(GenerateJvmLockfileFromTool.create(tool))
-            ),
+            ToolClasspathRequest(lockfile=(GenerateJvmLockfileFromTool.create(tool))),
         ),
         Get(Digest, CreateDigest([parser_source, Directory(dest_dir)])),
     )
 
-    merged_digest = await Get(
-        Digest,
-        MergeDigests(
-            (
-                tool_classpath.digest,
-                parser_classpath.digest,
-                source_digest,
-            )
-        ),
-    )
+    # NB: The classpaths are provided as immutable inputs rather than merged into the input digest,
+    # which saves merging them (and materializing copies of them) before the compile can start.
+    extra_immutable_input_digests = {
+        toolcp_relpath: tool_classpath.digest,
+        parsercp_relpath: parser_classpath.digest,
+    }
 
     process_result = await Get(
         ProcessResult,
         JvmProcess(
             jdk=jdk,
-            classpath_entries=tool_classpath.classpath_entries(),
+            classpath_entries=tool_classpath.classpath_entries(toolcp_relpath),
             argv=[
                 "scala.tools.nsc.Main",
                 "-bootclasspath",
-                ":".join(tool_classpath.classpath_entries()),
+                ":".join(tool_classpath.classpath_entries(toolcp_relpath)),
                 "-classpath",
-                ":".join(parser_classpath.classpath_entries()),
+                ":".join(parser_classpath.classpath_entries(parsercp_relpath)),
+                # NB: The parser is compiled once but then runs for every Scala source file, so it
+                # is worth optimizing. Inlining is restricted to the parser's own code: it is
+                # compiled against the scala-library of `_PARSER_SCALA_VERSION`, but runs against
+                # whichever (newer) version the tool lockfile resolves, so inlining library
+                # bytecode (including `private[scala]` internals) into it would not be safe.
+                "-opt:l:inline",
+                "-opt-inline-from:org.pantsbuild.**",
+                "-opt-warnings:none",
+                "-Ybackend-parallelism",
+                "4",
                 "-d",
                 dest_dir,
                 parser_source.path,
             ],
-            input_digest=merged_digest,
+            input_digest=source_digest,
+            extra_immutable_input_digests=extra_immutable_input_digests,
             output_directories=(dest_dir,),
             description="Compile Scala parser for dependency inference with scalac",
             level=LogLevel.DEBUG,
             # NB: We do not use nailgun for this process, since it is launched exactly once.
             use_nailgun=False,
+            # NB: All inputs to this process (the bundled parser source, the parser's lockfile and
+            # the compiler version) are static, so the default cache scope already persists the
+            # compiled classfiles in the local (and remote) process cache across daemon restarts.
+            # Nothing in its argv or inputs may vary between runs, or that reuse would be lost.
         ),
     )
     stripped_classfiles_digest = await Get(
@@ -1,5 +1,8 @@
 # Copyright 2021 Pants project contributors (see CONTRIBUTORS.md).
 # Licensed under the Apache License, Version 2.0 (see LICENSE).
+import copy
+import pickle
+import sys
 import textwrap
 
 import pytest
@@ -822,3 +825,90 @@ def test_applied_types_to_terms(rule_runner: RuleRunner) -> None:
         "foo.applied",
         "foo.bar",
     ]
+
+
+def test_blank_source(rule_runner: RuleRunner) -> None:
+    analysis = _analyze(
+        rule_runner,
+        textwrap.dedent(
+            """\
+            // This file intentionally left blank.
+
+            /*
+             * import foo.Bar
+             */
+            """
+        ),
+    )
+
+    assert not analysis.provided_symbols
+    assert not analysis.provided_symbols_encoded
+    assert not analysis.imports_by_scope
+    assert not analysis.consumed_symbols_by_scope
+    assert not analysis.scopes
+
+
+def test_from_json_dict_shares_identical_symbols() -> None:
+    def analysis_json(scope: str) -> dict:
+        return {
+            "providedSymbols": [{"name": f"{scope}.A", "recursive": False}],
+            "providedSymbolsEncoded": [],
+            "importsByScope": {scope: [{"name": "scala.collection.mutable", "isWildcard": True}]},
+            "consumedSymbolsByScope": {scope: [{"name": "String", "isAbsolute": False}]},
+            "scopes": [scope],
+        }
+
+    first = ScalaSourceDependencyAnalysis.from_json_dict(analysis_json("foo"))
+    second = ScalaSourceDependencyAnalysis.from_json_dict(analysis_json("bar"))
+
+    assert first.imports_by_scope["foo"][0] is second.imports_by_scope["bar"][0]
+    assert next(iter(first._consumed_symbols_by_scope["foo"])) is next(
+        iter(second._consumed_symbols_by_scope["bar"])
+    )
+    # Provided symbols are not shared, but their names are still interned.
+    assert next(iter(first.provided_symbols)).name is sys.intern("foo.A")
+
+
+def test_analysis_copy_and_pickle() -> None:
+    analysis = ScalaSourceDependencyAnalysis.from_json_dict(
+        {
+            "providedSymbols": [{"name": "foo.A", "recursive": False}],
+            "providedSymbolsEncoded": [{"name": "foo.A", "recursive": False}],
+            "importsByScope": {"foo": [{"name": "bar.B", "alias": "C", "isWildcard": False}]},
+            "consumedSymbolsByScope": {"foo": [{"name": "String", "isAbsolute": False}]},
+            "scopes": ["foo"],
+        }
+    )
+
+    assert copy.copy(analysis) == analysis
+    assert copy.deepcopy(analysis) == analysis
+    assert pickle.loads(pickle.dumps(analysis)) == analysis
+    assert copy.copy(analysis.imports_by_scope["foo"][0]) == ScalaImport(
+        name="bar.B", alias="C", is_wildcard=False
+    )
+
+
+def test_sorted_scope_map() -> None:
+    items = {"foo.bar": (2,), "": (0,), "foo": (1,)}
+    scope_map = scala_parser._SortedScopeMap(items)
+
+    assert list(scope_map) == ["", "foo", "foo.bar"]
+    assert len(scope_map) == 3
+    assert scope_map["foo"] == (1,)
+    with pytest.raises(KeyError):
+        scope_map["baz"]
+    assert "foo.bar" in scope_map
+    assert "baz" not in scope_map
+
+    assert scope_map.get("foo.bar") == (2,)
+    assert scope_map.get("baz") is None
+    assert scope_map.get("baz", ()) == ()
+
+    reordered = scala_parser._SortedScopeMap(dict(reversed(items.items())))
+    assert scope_map == reordered
+    assert hash(scope_map) == hash(reordered)
+    assert scope_map != scala_parser._SortedScopeMap({"foo": (1,)})
+
+    assert scope_map == items
+    assert scope_map == FrozenDict(items)
+    assert hash(scope_map) == hash(FrozenDict(items))
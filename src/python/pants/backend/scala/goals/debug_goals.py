@@ -38,7 +38,9 @@ async def dump_scala_source_analysis(targets: Targets, console: Console) -> Dump
         {"address": str(fs.address), **analysis.to_debug_json_dict()}
         for (fs, analysis) in zip(scala_source_field_sets, scala_source_analysis)
     ]
-    console.print_stdout(json.dumps(scala_source_analysis_json))
+    # NB: The structure above is freshly built from plain dicts, lists and strings, so there is no
+    # need for the encoder to track every container it visits to detect reference cycles.
+    console.print_stdout(json.dumps(scala_source_analysis_json, check_circular=False))
     return DumpScalaSourceAnalysis(exit_code=0)
 
 